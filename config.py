@@ -8,6 +8,7 @@ Author: vishal ravi
 Date: October 2024
 """
 
+import sys
 from pathlib import Path
 
 # Application Information
@@ -22,28 +23,34 @@ DEFAULT_BACKUP_SUFFIX = "_backup"
 
 # Default Column Names
 class ColumnNames:
-    """Default column names used throughout the application."""
-    
+    """Default column names used throughout the application.
+
+    The name constants are interned so the frequent equality checks
+    against workbook column names can take CPython's pointer-comparison
+    fast path; the collections are tuples so they can't be mutated or
+    re-allocated.
+    """
+
     # SMILES related columns
-    SMILES_VARIATIONS = ["smiles", "SMILES", "Smiles"]
-    
+    SMILES_VARIATIONS = ("smiles", "SMILES", "Smiles")
+
     # Formula related columns
-    FORMULA = "Formula"
-    CHEMICAL_FORMULA = "chemical_formula"
-    
+    FORMULA = sys.intern("Formula")
+    CHEMICAL_FORMULA = sys.intern("chemical_formula")
+
     # Metabolite related columns
-    METABOLITE_NAME = "Metabolite name"
-    
+    METABOLITE_NAME = sys.intern("Metabolite name")
+
     # Reference sheet columns
-    REFERENCE_FORMULA_COL = "chemical_formula"
-    REFERENCE_METABOLITE_COL = "Metabolite name"
+    REFERENCE_FORMULA_COL = sys.intern("chemical_formula")
+    REFERENCE_METABOLITE_COL = sys.intern("Metabolite name")
 
 # Default Sheet Names
 class SheetNames:
     """Default sheet names and reference sheet settings."""
-    
-    REFERENCE_SHEET = "Sheet1"
-    EXCLUDED_SHEETS = []  # Sheets to exclude from processing
+
+    REFERENCE_SHEET = sys.intern("Sheet1")
+    EXCLUDED_SHEETS = ()  # Sheets to exclude from processing
 
 # Processing Settings
 class ProcessingSettings:
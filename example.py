@@ -9,25 +9,12 @@ Author: vishal ravi
 Date: October 2024
 """
 
-import pandas as pd
 import logging
 from pathlib import Path
 
-# Import our modules
-from smiles_utils import (
-    smiles_to_formula, 
-    add_formula_column, 
-    find_smiles_column,
-    get_formula_statistics,
-    validate_smiles
-)
-from metabolite_mapper import (
-    create_formula_metabolite_mapping,
-    apply_metabolite_mapping,
-    get_mapping_statistics,
-    find_unmatched_formulas
-)
-from excel_processor import ExcelProcessor, validate_excel_file
+# Heavy imports (pandas, rdkit via the project modules) are done lazily
+# inside each example so that running a single lightweight example does
+# not pay the full import cost at startup.
 from config import DEFAULT_CONFIG, ColumnNames
 
 
@@ -46,7 +33,9 @@ def example_1_basic_smiles_processing():
     print("\n" + "="*60)
     print("Example 1: Basic SMILES Processing")
     print("="*60)
-    
+
+    from smiles_utils import smiles_to_formula, validate_smiles
+
     # Sample SMILES data
     sample_smiles = [
         'CCO',                                    # Ethanol
@@ -77,7 +66,10 @@ def example_2_dataframe_processing():
     print("\n" + "="*60)
     print("Example 2: DataFrame Processing")
     print("="*60)
-    
+
+    import pandas as pd
+    from smiles_utils import add_formula_column, find_smiles_column, get_formula_statistics
+
     # Create sample DataFrame
     data = {
         'smiles': [
@@ -127,7 +119,16 @@ def example_3_metabolite_mapping():
     print("\n" + "="*60)
     print("Example 3: Metabolite Name Mapping")
     print("="*60)
-    
+
+    import pandas as pd
+    from smiles_utils import add_formula_column, find_smiles_column
+    from metabolite_mapper import (
+        create_formula_metabolite_mapping,
+        apply_metabolite_mapping,
+        get_mapping_statistics,
+        find_unmatched_formulas
+    )
+
     # Create reference DataFrame (like Sheet1)
     reference_data = {
         'chemical_formula': ['C2H6O', 'C8H10N4O2', 'C6H12O6', 'H2O'],
@@ -198,7 +199,9 @@ def example_4_excel_file_processing():
     print("\n" + "="*60)
     print("Example 4: Excel File Processing")
     print("="*60)
-    
+
+    from excel_processor import ExcelProcessor, validate_excel_file
+
     # Check if the example input file exists
     input_file = "swissadmet 92.xlsx"
     
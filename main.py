@@ -1,76 +1,155 @@
+import functools
+
+import numpy as np
 import pandas as pd
 from rdkit import Chem
 from rdkit.Chem import rdMolDescriptors
 
+# Bind the RDKit entry points once; the per-SMILES loop then skips the
+# module/attribute lookups on every call
+_mol_from_smiles = Chem.MolFromSmiles
+_calc_formula = rdMolDescriptors.CalcMolFormula
+
+# Placeholder strings that exports commonly leave in SMILES columns;
+# these can never parse, so skip RDKit's per-call setup for them
+_KNOWN_BAD = frozenset({'', 'nan', 'none', 'n/a', 'na', 'invalid'})
+
+# Use the Rust-backed calamine engine when installed; it parses XLSX far
+# faster than openpyxl's pure-Python XML path
+try:
+    import python_calamine  # noqa: F401
+    READ_ENGINE = "calamine"
+except ImportError:
+    READ_ENGINE = "openpyxl"
+
+# Write output with xlsxwriter instead of openpyxl; it serializes
+# workbooks noticeably faster. Note: constant_memory mode cannot be used
+# here because pandas emits cells column by column, and constant_memory
+# discards writes to rows that have already been flushed.
+try:
+    import xlsxwriter  # noqa: F401
+    WRITE_ENGINE = "xlsxwriter"
+    WRITE_ENGINE_KWARGS = {"options": {"strings_to_numbers": False}}
+except ImportError:
+    WRITE_ENGINE = "openpyxl"
+    WRITE_ENGINE_KWARGS = {}
+
+def _lower_index(df) -> dict:
+    """Map lower-cased column names to their actual spelling."""
+    return {col.lower(): col for col in df.columns}
+
+
+@functools.lru_cache(maxsize=None)
 def smiles_to_formula(smiles: str) -> str:
-    """Convert SMILES to chemical formula"""
+    """Convert SMILES to chemical formula (memoized across sheets)"""
+    if not isinstance(smiles, str) or smiles.lower() in _KNOWN_BAD:
+        return "Invalid"
     try:
-        mol = Chem.MolFromSmiles(smiles)
-        if mol:
-            return rdMolDescriptors.CalcMolFormula(mol)
-        else:
-            return "Invalid"
-    except:
+        mol = _mol_from_smiles(smiles)
+        return _calc_formula(mol) if mol is not None else "Invalid"
+    except Exception:
         return "Error"
 
 # Input/Output Excel filenames
 input_file = "swissadmet 92.xlsx"    # change to your file
 output_file = "output_with_formulas.xlsx"
 
-# Read all sheets
-xls = pd.ExcelFile(input_file)
-sheet_names = xls.sheet_names
-
-# Dictionary to store updated DataFrames
-updated_sheets = {}
-
-for sheet in sheet_names:
-    df = pd.read_excel(input_file, sheet_name=sheet)
-
-    # Check for SMILES column (case-insensitive)
-    smiles_column = None
-    for col in df.columns:
-        if col.lower() == 'smiles':
-            smiles_column = col
-            break
-    
-    if smiles_column:
-        df["Formula"] = df[smiles_column].apply(smiles_to_formula)
-        print(f"Sheet '{sheet}': Added Formula column using '{smiles_column}' column.")
-    else:
+# The columns the pipeline touches are read as typed string arrays
+# instead of inferred objects
+string_dtypes = {col: "string" for col in
+                 ("smiles", "SMILES", "Smiles", "chemical_formula", "Metabolite name")}
+
+
+def add_formula_column(sheet: str, df):
+    """Add a Formula column from the sheet's SMILES column, if it has one.
+
+    Returns the (unique_formulas, inverse) pair used to build the column
+    so the caller can derive further per-formula columns without
+    rescanning the sheet, or None when there is no SMILES column.
+    """
+    smiles_column = _lower_index(df).get('smiles')
+    if not smiles_column:
         print(f"Sheet '{sheet}' does not have a 'SMILES' column. Skipping.")
+        return None
+
+    # Parse each distinct SMILES once, then scatter the formulas back
+    # over the rows with NumPy indexing instead of a dict map
+    values = df[smiles_column].to_numpy(dtype=object)
+    na_mask = pd.isna(values)
+    uniq, inverse = np.unique(np.where(na_mask, "", values), return_inverse=True)
+    unique_formulas = np.array([smiles_to_formula(s) for s in uniq], dtype=object)
+    formulas = unique_formulas[inverse]
+    formulas[na_mask] = "Error"
+    df["Formula"] = formulas
+    print(f"Sheet '{sheet}': Added Formula column using '{smiles_column}' column.")
+    return unique_formulas, inverse
+
+
+# Stream sheets one at a time instead of holding the whole workbook:
+# Sheet1 is read first to build the formula -> metabolite mapping and is
+# written out immediately; every other sheet is then read, processed and
+# written before the next one is loaded, so peak memory stays at one
+# sheet rather than the full workbook.
+with pd.ExcelFile(input_file, engine=READ_ENGINE) as xls, \
+        pd.ExcelWriter(output_file, engine=WRITE_ENGINE,
+                       engine_kwargs=WRITE_ENGINE_KWARGS) as writer:
+    sheet_names = xls.sheet_names
+
+    # Build the chemical_formula -> Metabolite name mapping from Sheet1
+    formula_to_metabolite = {}
+    if 'Sheet1' in sheet_names:
+        sheet1_df = pd.read_excel(xls, sheet_name='Sheet1', dtype=string_dtypes)
+        add_formula_column('Sheet1', sheet1_df)
+
+        sheet1_cols = _lower_index(sheet1_df)
+        formula_col = sheet1_cols.get('chemical_formula')
+        metabolite_col = sheet1_cols.get('metabolite name')
+
+        if formula_col and metabolite_col:
+            # Handle potential duplicates by taking the first occurrence
+            pairs = sheet1_df[[formula_col, metabolite_col]].dropna()
+            keep = ~pairs[formula_col].duplicated()
+            formula_to_metabolite = dict(zip(pairs.loc[keep, formula_col],
+                                             pairs.loc[keep, metabolite_col]))
+            print(f"Created mapping for {len(formula_to_metabolite)} unique formulas from Sheet1")
+
+        sheet1_df.to_excel(writer, sheet_name='Sheet1', index=False)
+        del sheet1_df
+
+    # Process and write the remaining sheets one at a time
+    for sheet in sheet_names:
+        if sheet == 'Sheet1':
+            continue
+        df = pd.read_excel(xls, sheet_name=sheet, dtype=string_dtypes)
+        formula_result = add_formula_column(sheet, df)
+
+        if formula_result is not None:
+            # Fused pass: look up the metabolite for each unique formula
+            # and scatter with the same inverse index used for Formula,
+            # instead of rescanning the written column
+            unique_formulas, inverse = formula_result
+            unique_metabolites = np.array(
+                [formula_to_metabolite.get(f, np.nan) for f in unique_formulas],
+                dtype=object)
+            metabolites = unique_metabolites[inverse]
+            df['Metabolite name'] = metabolites
+        elif 'Formula' in df.columns:
+            # No SMILES column, but the sheet already carries formulas:
+            # map those directly, as the per-sheet loop always has
+            metabolites = df['Formula'].map(formula_to_metabolite)
+            df['Metabolite name'] = metabolites
+        else:
+            metabolites = None
+
+        if metabolites is not None:
+            # Count matches
+            matches = int(pd.notna(metabolites).sum())
+            total = len(df)
+            print(f"Sheet '{sheet}': Added Metabolite name column with {matches}/{total} matches")
 
-    updated_sheets[sheet] = df
-
-# Create a mapping from chemical_formula to Metabolite name from Sheet1
-sheet1_df = updated_sheets.get('Sheet1')
-formula_to_metabolite = {}
-
-if sheet1_df is not None and 'chemical_formula' in sheet1_df.columns and 'Metabolite name' in sheet1_df.columns:
-    # Create mapping dictionary, handling potential duplicates by taking the first occurrence
-    for idx, row in sheet1_df.iterrows():
-        formula = row['chemical_formula']
-        metabolite = row['Metabolite name']
-        if pd.notna(formula) and pd.notna(metabolite) and formula not in formula_to_metabolite:
-            formula_to_metabolite[formula] = metabolite
-    print(f"Created mapping for {len(formula_to_metabolite)} unique formulas from Sheet1")
-
-# Add Metabolite name column to other sheets based on Formula matching
-for sheet_name, df in updated_sheets.items():
-    if sheet_name != 'Sheet1' and 'Formula' in df.columns:
-        # Add Metabolite name column by matching Formula with chemical_formula from Sheet1
-        df['Metabolite name'] = df['Formula'].map(formula_to_metabolite)
-        
-        # Count matches
-        matches = df['Metabolite name'].notna().sum()
-        total = len(df)
-        print(f"Sheet '{sheet_name}': Added Metabolite name column with {matches}/{total} matches")
-        
-        updated_sheets[sheet_name] = df
-
-# Save back to Excel with all sheets
-with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-    for sheet, df in updated_sheets.items():
         df.to_excel(writer, sheet_name=sheet, index=False)
+        del df
 
+cache_info = smiles_to_formula.cache_info()
+print(f"SMILES cache: {cache_info.hits} hits, {cache_info.misses} misses")
 print(f"Updated Excel saved as: {output_file}")
@@ -8,28 +8,48 @@ Author: vishal ravi
 Date: October 2024
 """
 
-from typing import Dict, Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List, Union
+import numpy as np
 import pandas as pd
 import logging
 
+# pyarrow is optional; when present, very large reference sheets are
+# grouped in native Arrow code instead of through Python objects
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Above this many reference rows the mapping build goes through pyarrow
+# when it is installed
+_ARROW_MIN_REFERENCE_ROWS = 200_000
+
 
-def create_formula_metabolite_mapping(reference_df: pd.DataFrame, 
+def create_formula_metabolite_mapping(reference_df: pd.DataFrame,
                                      formula_column: str = 'chemical_formula',
-                                     metabolite_column: str = 'Metabolite name') -> Dict[str, str]:
+                                     metabolite_column: str = 'Metabolite name',
+                                     as_series: bool = False) -> Union[Dict[str, str], pd.Series]:
     """
     Create a mapping dictionary from chemical formulas to metabolite names.
-    
+
     Args:
         reference_df (pd.DataFrame): Reference DataFrame containing formula and metabolite data
         formula_column (str): Name of the column containing chemical formulas
         metabolite_column (str): Name of the column containing metabolite names
-        
+        as_series (bool): Return the mapping as a pd.Series indexed by
+                          formula; Series.map(Series) uses pandas' aligned
+                          join path, which is faster on large sheets
+
     Returns:
-        Dict[str, str]: Mapping from chemical formula to metabolite name
-        
+        Union[Dict[str, str], pd.Series]: Mapping from chemical formula to
+        metabolite name (always a Series for very large references, which
+        are built through pyarrow when it is installed)
+
     Raises:
         ValueError: If required columns are not found in the DataFrame
         
@@ -48,55 +68,93 @@ def create_formula_metabolite_mapping(reference_df: pd.DataFrame,
     
     if metabolite_column not in reference_df.columns:
         raise ValueError(f"Metabolite column '{metabolite_column}' not found in reference DataFrame")
-    
-    # Create mapping dictionary
-    formula_to_metabolite = {}
-    
-    for idx, row in reference_df.iterrows():
-        formula = row[formula_column]
-        metabolite = row[metabolite_column]
-        
-        # Skip rows with missing data
-        if pd.isna(formula) or pd.isna(metabolite):
-            continue
-            
-        # Convert to string and clean
-        formula_str = str(formula).strip()
-        metabolite_str = str(metabolite).strip()
-        
-        # Skip empty values
-        if not formula_str or not metabolite_str:
-            continue
-            
-        # Use first occurrence for duplicate formulas
-        if formula_str not in formula_to_metabolite:
-            formula_to_metabolite[formula_str] = metabolite_str
-        else:
-            logger.debug(f"Duplicate formula '{formula_str}' found, keeping first occurrence")
-    
+
+    # Very large references: clean and group entirely in Arrow native
+    # code, bypassing Python string objects (always returned as a Series)
+    if pa is not None and len(reference_df) > _ARROW_MIN_REFERENCE_ROWS:
+        formula_to_metabolite = _build_mapping_arrow(reference_df, formula_column, metabolite_column)
+        logger.info(f"Created mapping for {len(formula_to_metabolite)} unique formulas (arrow)")
+        return formula_to_metabolite
+
+    # Create mapping dictionary with vectorized cleaning: drop missing
+    # pairs, strip whitespace, discard empties, keep first occurrence of
+    # duplicate formulas
+    pairs = reference_df[[formula_column, metabolite_column]].dropna()
+    formulas = pairs[formula_column].astype(str).str.strip()
+    metabolites = pairs[metabolite_column].astype(str).str.strip()
+
+    non_empty = (formulas != '') & (metabolites != '')
+    formulas = formulas[non_empty]
+    metabolites = metabolites[non_empty]
+
+    first_occurrence = ~formulas.duplicated()
+    if as_series:
+        formula_to_metabolite = pd.Series(metabolites[first_occurrence].to_numpy(),
+                                          index=formulas[first_occurrence].to_numpy())
+    else:
+        formula_to_metabolite = dict(zip(formulas[first_occurrence].tolist(),
+                                         metabolites[first_occurrence].tolist()))
+
     logger.info(f"Created mapping for {len(formula_to_metabolite)} unique formulas")
     return formula_to_metabolite
 
 
+def _build_mapping_arrow(reference_df: pd.DataFrame,
+                         formula_column: str,
+                         metabolite_column: str) -> pd.Series:
+    """Build the formula -> metabolite Series with pyarrow group-by.
+
+    Mirrors the pandas path: drop missing pairs, strip whitespace,
+    discard empties, keep the first occurrence of duplicate formulas.
+    """
+    table = pa.Table.from_pandas(reference_df[[formula_column, metabolite_column]],
+                                 preserve_index=False)
+    table = table.drop_null()
+
+    formulas = pc.utf8_trim_whitespace(table[formula_column].cast(pa.string()))
+    metabolites = pc.utf8_trim_whitespace(table[metabolite_column].cast(pa.string()))
+    non_empty = pc.and_(pc.not_equal(formulas, ''), pc.not_equal(metabolites, ''))
+
+    pairs = pa.table({'formula': formulas, 'metabolite': metabolites}).filter(non_empty)
+    # use_threads=False keeps row order so 'first' matches the dict path
+    grouped = pairs.group_by('formula', use_threads=False).aggregate([('metabolite', 'first')])
+
+    return pd.Series(grouped['metabolite_first'].to_numpy(zero_copy_only=False),
+                     index=grouped['formula'].to_numpy(zero_copy_only=False))
+
+
 def apply_metabolite_mapping(target_df: pd.DataFrame,
-                            mapping: Dict[str, str],
+                            mapping: Union[Dict[str, str], pd.Series],
                             formula_column: str = 'Formula',
-                            new_metabolite_column: str = 'Metabolite name') -> pd.DataFrame:
+                            new_metabolite_column: str = 'Metabolite name',
+                            inplace: bool = False,
+                            return_stats: bool = False) -> Union[pd.DataFrame,
+                                                                 Tuple[pd.DataFrame, Dict[str, int]]]:
     """
     Apply metabolite name mapping to a target DataFrame based on chemical formulas.
-    
+
     Args:
         target_df (pd.DataFrame): Target DataFrame to add metabolite names to
-        mapping (Dict[str, str]): Mapping from chemical formula to metabolite name
+        mapping (Union[Dict[str, str], pd.Series]): Mapping from chemical
+                        formula to metabolite name; a Series maps via pandas'
+                        faster aligned join path
         formula_column (str): Name of the column containing formulas in target DataFrame
         new_metabolite_column (str): Name for the new metabolite column
-        
+        inplace (bool): Assign the new column directly on target_df instead
+                        of copying it first; avoids doubling peak memory
+                        when the caller discards the original anyway
+        return_stats (bool): Also return the mapping statistics dict (same
+                        shape as get_mapping_statistics), reusing the
+                        notna pass done for the log line instead of
+                        rescanning the column
+
     Returns:
-        pd.DataFrame: DataFrame with added metabolite name column
-        
+        pd.DataFrame: DataFrame with added metabolite name column, or a
+                      (DataFrame, stats) tuple when return_stats is True
+
     Raises:
         ValueError: If the formula column is not found in the target DataFrame
-        
+
     Examples:
         >>> df = pd.DataFrame({'Formula': ['C6H12O6', 'C8H10N4O2']})
         >>> mapping = {'C6H12O6': 'Glucose', 'C8H10N4O2': 'Caffeine'}
@@ -106,22 +164,126 @@ def apply_metabolite_mapping(target_df: pd.DataFrame,
     """
     if formula_column not in target_df.columns:
         raise ValueError(f"Formula column '{formula_column}' not found in target DataFrame")
+
+    # Copy unless the caller opted in to in-place assignment
+    result_df = target_df if inplace else target_df.copy()
+
+    # Map through a Series so pandas can take its aligned join path
+    if not isinstance(mapping, pd.Series):
+        mapping = pd.Series(mapping)
+
+    # Go through category dtype: formulas are low-cardinality, so each
+    # unique formula is hashed and mapped once and the full column is
+    # rebuilt by scattering the mapped categories over the codes
+    formulas = result_df[formula_column]
+    if not isinstance(formulas.dtype, pd.CategoricalDtype):
+        formulas = formulas.astype('category')
+    mapped_categories = formulas.cat.categories.map(mapping)
+    # Trailing NaN sentinel so code -1 (missing formula) maps to NaN
+    lookup = np.append(mapped_categories.to_numpy(dtype=object), np.nan)
+    result_df[new_metabolite_column] = lookup[formulas.cat.codes]
     
-    # Create a copy to avoid modifying the original DataFrame
-    result_df = target_df.copy()
-    
-    # Apply mapping using pandas map function
-    result_df[new_metabolite_column] = result_df[formula_column].map(mapping)
-    
-    # Count successful mappings
-    matches = result_df[new_metabolite_column].notna().sum()
+    # Count successful mappings (single notna pass, shared with the stats)
+    matches = int(result_df[new_metabolite_column].notna().sum())
     total = len(result_df)
-    
-    logger.info(f"Applied metabolite mapping: {matches}/{total} matches ({matches/total*100:.1f}%)")
+
+    success_rate = (matches / total * 100) if total > 0 else 0
+    logger.info(f"Applied metabolite mapping: {matches}/{total} matches ({success_rate:.1f}%)")
+    if return_stats:
+        stats = {
+            'total': total,
+            'matched': matches,
+            'unmatched': total - matches,
+            'success_rate': success_rate
+        }
+        return result_df, stats
+    return result_df
+
+
+# Above this many reference rows merge_metabolite_data joins against an
+# indexed reference frame instead of building a Python mapping
+_MERGE_MIN_REFERENCE_ROWS = 50_000
+
+
+def apply_metabolite_mapping_via_merge(target_df: pd.DataFrame,
+                                      reference_df: pd.DataFrame,
+                                      reference_formula_column: str = 'chemical_formula',
+                                      reference_metabolite_column: str = 'Metabolite name',
+                                      formula_column: str = 'Formula',
+                                      new_metabolite_column: str = 'Metabolite name',
+                                      inplace: bool = False,
+                                      return_stats: bool = False) -> Union[pd.DataFrame,
+                                                                           Tuple[pd.DataFrame, Dict[str, int]]]:
+    """
+    Apply metabolite mapping by joining against an indexed reference frame.
+
+    Unlike apply_metabolite_mapping this never materializes a Python
+    dict: the reference columns are deduplicated and indexed by formula
+    once, then joined onto the target with pandas' hash join. On large
+    reference sheets (hundreds of thousands of rows) this scales better
+    than building and probing a dict.
+
+    Args:
+        target_df (pd.DataFrame): Target DataFrame to add metabolite names to
+        reference_df (pd.DataFrame): Reference DataFrame with formula and metabolite columns
+        reference_formula_column (str): Formula column name in the reference DataFrame
+        reference_metabolite_column (str): Metabolite column name in the reference DataFrame
+        formula_column (str): Name of the column containing formulas in target DataFrame
+        new_metabolite_column (str): Name for the new metabolite column
+        inplace (bool): Assign the new column directly on target_df instead of copying
+        return_stats (bool): Also return the mapping statistics dict
+
+    Returns:
+        pd.DataFrame: DataFrame with added metabolite name column, or a
+                      (DataFrame, stats) tuple when return_stats is True
+
+    Raises:
+        ValueError: If a required column is missing from either DataFrame
+    """
+    if formula_column not in target_df.columns:
+        raise ValueError(f"Formula column '{formula_column}' not found in target DataFrame")
+
+    for column in (reference_formula_column, reference_metabolite_column):
+        if column not in reference_df.columns:
+            raise ValueError(f"Column '{column}' not found in reference DataFrame")
+
+    # Clean and deduplicate the reference once, mirroring
+    # create_formula_metabolite_mapping: drop missing pairs, strip
+    # whitespace, discard empties, keep the first occurrence of duplicate
+    # formulas, then index by formula for the join
+    pairs = reference_df[[reference_formula_column, reference_metabolite_column]].dropna()
+    formulas = pairs[reference_formula_column].astype(str).str.strip()
+    metabolites = pairs[reference_metabolite_column].astype(str).str.strip()
+
+    non_empty = (formulas != '') & (metabolites != '')
+    formulas = formulas[non_empty]
+    metabolites = metabolites[non_empty]
+
+    first_occurrence = ~formulas.duplicated()
+    reference = pd.Series(metabolites[first_occurrence].to_numpy(),
+                          index=formulas[first_occurrence].to_numpy(),
+                          name=new_metabolite_column)
+
+    result_df = target_df if inplace else target_df.copy()
+    # reindex performs the left join against the formula index in native code
+    mapped = reference.reindex(result_df[formula_column])
+    result_df[new_metabolite_column] = mapped.to_numpy()
+
+    matches = int(result_df[new_metabolite_column].notna().sum())
+    total = len(result_df)
+    logger.info(f"Applied metabolite mapping via merge: {matches}/{total} matches")
+    if return_stats:
+        stats = {
+            'total': total,
+            'matched': matches,
+            'unmatched': total - matches,
+            'success_rate': (matches / total * 100) if total > 0 else 0
+        }
+        return result_df, stats
     return result_df
 
 
-def get_mapping_statistics(target_df: pd.DataFrame, 
+def get_mapping_statistics(target_df: pd.DataFrame,
                           metabolite_column: str = 'Metabolite name') -> Dict[str, int]:
     """
     Get statistics about metabolite mapping success rate.
@@ -141,9 +303,11 @@ def get_mapping_statistics(target_df: pd.DataFrame,
     """
     if metabolite_column not in target_df.columns:
         raise ValueError(f"Metabolite column '{metabolite_column}' not found in DataFrame")
-    
+
     total = len(target_df)
-    matched = target_df[metabolite_column].notna().sum()
+    # Count over the raw array instead of a notna() Series
+    metabolites = target_df[metabolite_column].to_numpy()
+    matched = int((~pd.isna(metabolites)).sum())
     unmatched = total - matched
     
     stats = {
@@ -185,9 +349,12 @@ def find_unmatched_formulas(target_df: pd.DataFrame,
     if metabolite_column not in target_df.columns:
         raise ValueError(f"Metabolite column '{metabolite_column}' not found in DataFrame")
     
-    # Find rows where metabolite name is missing but formula exists
-    unmatched_mask = (target_df[metabolite_column].isna()) & (target_df[formula_column].notna())
-    unmatched_formulas = target_df.loc[unmatched_mask, formula_column].unique().tolist()
+    # Find rows where metabolite name is missing but formula exists, in a
+    # single pass over the raw arrays
+    formulas = target_df[formula_column].to_numpy()
+    metabolites = target_df[metabolite_column].to_numpy()
+    unmatched_mask = pd.isna(metabolites) & ~pd.isna(formulas)
+    unmatched_formulas = pd.unique(formulas[unmatched_mask]).tolist()
     
     logger.info(f"Found {len(unmatched_formulas)} unmatched formulas")
     return unmatched_formulas
@@ -251,23 +418,34 @@ def merge_metabolite_data(reference_df: pd.DataFrame,
         >>> print(result[0]['Metabolite name'].iloc[0])
         'Glucose'
     """
-    # Create mapping from reference data
-    mapping = create_formula_metabolite_mapping(
-        reference_df, 
-        reference_formula_col, 
-        reference_metabolite_col
-    )
-    
+    # Large reference sheets skip the Python mapping entirely and join
+    # against the indexed reference frame instead
+    use_merge = len(reference_df) > _MERGE_MIN_REFERENCE_ROWS
+    if not use_merge:
+        # Create mapping from reference data (as a Series for the fast map path)
+        mapping = create_formula_metabolite_mapping(
+            reference_df,
+            reference_formula_col,
+            reference_metabolite_col,
+            as_series=True
+        )
+
     # Apply mapping to each target DataFrame
     result_dfs = []
-    
+
     for i, (target_df, sheet_name) in enumerate(zip(target_dfs, sheet_names)):
         if target_formula_col in target_df.columns:
-            # Apply metabolite mapping
-            updated_df = apply_metabolite_mapping(target_df, mapping, target_formula_col)
-            
-            # Log statistics
-            stats = get_mapping_statistics(updated_df)
+            # Apply metabolite mapping (in place: the caller replaces its
+            # frames with the returned ones); reuse the stats it computed
+            # instead of rescanning the column
+            if use_merge:
+                updated_df, stats = apply_metabolite_mapping_via_merge(
+                    target_df, reference_df,
+                    reference_formula_col, reference_metabolite_col,
+                    target_formula_col, inplace=True, return_stats=True)
+            else:
+                updated_df, stats = apply_metabolite_mapping(target_df, mapping, target_formula_col,
+                                                             inplace=True, return_stats=True)
             logger.info(f"Sheet '{sheet_name}': {stats['matched']}/{stats['total']} metabolite matches")
             
             result_dfs.append(updated_df)
@@ -21,7 +21,7 @@ from typing import Optional
 
 # Import our custom modules
 from smiles_utils import find_smiles_column, add_formula_column, get_formula_statistics
-from metabolite_mapper import create_formula_metabolite_mapping, apply_metabolite_mapping, get_mapping_statistics
+from metabolite_mapper import create_formula_metabolite_mapping, apply_metabolite_mapping
 from excel_processor import ExcelProcessor, validate_excel_file
 from config import (
     DEFAULT_CONFIG, ColumnNames, SheetNames, ProcessingSettings, 
@@ -94,6 +94,13 @@ Examples:
         action='store_true',
         help='Skip creating backup of input file'
     )
+
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='Number of worker processes for SMILES parsing (-1 = all CPUs, default: 1)'
+    )
     
     parser.add_argument(
         '--verbose', '-v',
@@ -110,14 +117,15 @@ Examples:
     return parser.parse_args()
 
 
-def process_formulas(processor: ExcelProcessor, sheets_data: dict) -> dict:
+def process_formulas(processor: ExcelProcessor, sheets_data: dict, n_jobs: int = 1) -> dict:
     """
     Process SMILES data and add molecular formulas to sheets.
-    
+
     Args:
         processor (ExcelProcessor): Excel processor instance
         sheets_data (dict): Dictionary of sheet data
-        
+        n_jobs (int): Number of worker processes for SMILES parsing
+
     Returns:
         dict: Updated sheets data with formulas
     """
@@ -136,7 +144,7 @@ def process_formulas(processor: ExcelProcessor, sheets_data: dict) -> dict:
         if smiles_column:
             try:
                 # Add formula column
-                updated_df = add_formula_column(df, smiles_column, ColumnNames.FORMULA)
+                updated_df = add_formula_column(df, smiles_column, ColumnNames.FORMULA, n_jobs=n_jobs)
                 
                 # Get statistics
                 stats = get_formula_statistics(updated_df, ColumnNames.FORMULA)
@@ -203,41 +211,37 @@ def process_metabolite_mapping(sheets_data: dict, reference_sheet: str) -> dict:
         logger.error(f"Error creating metabolite mapping: {e}")
         return sheets_data
     
-    # Apply mapping to other sheets
-    updated_sheets = {}
+    # Apply mapping to other sheets, updating sheets_data in place: the
+    # mapping itself is in place too, so untouched sheets keep their
+    # existing entries and no parallel dict is built
     total_mappings = 0
-    
+
     for sheet_name, df in sheets_data.items():
         if sheet_name == reference_sheet:
             # Keep reference sheet unchanged
-            updated_sheets[sheet_name] = df
             continue
-        
+
         if ColumnNames.FORMULA in df.columns:
             try:
-                # Apply metabolite mapping
-                updated_df = apply_metabolite_mapping(
-                    df, mapping, ColumnNames.FORMULA, ColumnNames.METABOLITE_NAME
+                # Apply metabolite mapping; reuse the stats it already
+                # computes instead of rescanning the column
+                _, stats = apply_metabolite_mapping(
+                    df, mapping, ColumnNames.FORMULA, ColumnNames.METABOLITE_NAME,
+                    inplace=True, return_stats=True
                 )
-                
-                # Get statistics
-                stats = get_mapping_statistics(updated_df, ColumnNames.METABOLITE_NAME)
-                
+
                 logger.info(f"Sheet '{sheet_name}': Mapped {stats['matched']}/{stats['total']} metabolites "
                            f"({stats['success_rate']:.1f}% success rate)")
-                
+
                 total_mappings += stats['matched']
-                updated_sheets[sheet_name] = updated_df
-                
+
             except Exception as e:
                 logger.error(f"Error mapping metabolites for sheet '{sheet_name}': {e}")
-                updated_sheets[sheet_name] = df
         else:
             logger.warning(f"Sheet '{sheet_name}': No formula column found for metabolite mapping")
-            updated_sheets[sheet_name] = df
-    
+
     logger.info(f"✓ Metabolite mapping completed: {total_mappings} total mappings applied")
-    return updated_sheets
+    return sheets_data
 
 
 def generate_summary_report(processor: ExcelProcessor, final_sheets: dict) -> None:
@@ -339,7 +343,7 @@ def main() -> int:
             return 1
         
         # Process formulas
-        sheets_with_formulas = process_formulas(processor, sheets_data)
+        sheets_with_formulas = process_formulas(processor, sheets_data, n_jobs=args.jobs)
         
         # Process metabolite mapping
         final_sheets = process_metabolite_mapping(sheets_with_formulas, args.reference)
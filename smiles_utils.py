@@ -8,15 +8,90 @@ Author: vishal ravi
 Date: October 2024
 """
 
-from typing import Optional, Union
+import functools
+import os
+import re
+from typing import Optional, Tuple, Union
+import numpy as np
 import pandas as pd
 from rdkit import Chem
 from rdkit.Chem import rdMolDescriptors
 import logging
 
+# joblib is optional; when present, large batches are converted across
+# worker processes (RDKit's wrappers hold the GIL, so threads don't help)
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    Parallel = None
+    delayed = None
+
+# Persistent on-disk formula cache so repeated runs over overlapping
+# datasets skip RDKit entirely; set METABOLITE_CACHE to relocate it or
+# to an empty string to disable it
+try:
+    from joblib import Memory
+    _cache_location = os.environ.get('METABOLITE_CACHE',
+                                     os.path.join('~', '.cache', 'metabolite_formula'))
+    _memory = (Memory(os.path.expanduser(_cache_location), verbose=0)
+               if _cache_location else None)
+except ImportError:
+    _memory = None
+
+# Optional compiled batch converter: a smiles_formula_ext module (built
+# and installed separately) may export formula_batch(list[str]) ->
+# list[str] that calls RDKit's C++ API with the GIL released; when
+# importable it takes over whole-batch conversion
+try:
+    from smiles_formula_ext import formula_batch as _formula_batch_ext
+except ImportError:
+    _formula_batch_ext = None
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Module-level bindings for the RDKit entry points; saves the attribute
+# lookups in the per-SMILES hot path
+_mol_from_smiles = Chem.MolFromSmiles
+_calc_formula = rdMolDescriptors.CalcMolFormula
+_sanitize_mol = Chem.SanitizeMol
+
+# Parse without sanitization, then sanitize with only the stages that can
+# affect atom and implicit-H counts (and hence the formula). Chirality
+# cleanup, conjugation and hybridization are skipped; cleanup must stay,
+# as it normalizes hypervalent forms (nitro, perchlorate, ...) before the
+# valence check. The subset was validated to give formulas and validity
+# identical to a full MolFromSmiles over representative valid and
+# invalid SMILES.
+_PARSER_PARAMS = Chem.SmilesParserParams()
+_PARSER_PARAMS.sanitize = False
+_PARSER_PARAMS.removeHs = False
+_FORMULA_SANITIZE_OPS = (Chem.SANITIZE_ALL
+                         ^ Chem.SANITIZE_CLEANUPCHIRALITY
+                         ^ Chem.SANITIZE_SETCONJUGATION
+                         ^ Chem.SANITIZE_SETHYBRIDIZATION)
+
+# Placeholder strings that exports commonly leave in SMILES columns;
+# skipping the RDKit parser for these saves its per-call setup cost
+_KNOWN_BAD = frozenset({'nan', 'none', 'n/a', 'na', 'invalid'})
+
+# SMILES' lexical alphabet; strings with characters outside it (spaces,
+# commas, underscores, ...) can never parse, so they are rejected with a
+# cheap linear scan instead of a full RDKit parse attempt
+_SMILES_CHARSET = re.compile(r'[A-Za-z0-9@+\-\[\]\(\)=#$/\\\.%:*]+')
+
+# Trivial molecules that dominate metabolite tables (water, simple ions,
+# gases); their formulas are precomputed — values generated with RDKit's
+# CalcMolFormula — so these strings never reach the parser at all
+_TRIVIAL = {
+    'C': 'CH4', 'N': 'H3N', 'O': 'H2O', 'S': 'H2S', 'P': 'H3P',
+    'F': 'HF', 'Cl': 'HCl', 'Br': 'HBr', 'I': 'HI', 'B': 'H3B',
+    '[H]': 'H', '[Na+]': 'Na+', '[K+]': 'K+', '[Cl-]': 'Cl-',
+    '[Ca+2]': 'Ca+2', '[Mg+2]': 'Mg+2', '[NH4+]': 'H4N+', '[OH-]': 'HO-',
+    'O=O': 'O2', 'N#N': 'N2', 'C#N': 'CHN', 'C=O': 'CH2O', 'O=C=O': 'CO2',
+    'CO': 'CH4O', 'CC': 'C2H6', 'CCO': 'C2H6O',
+}
+
 
 def smiles_to_formula(smiles: str) -> str:
     """
@@ -39,67 +114,234 @@ def smiles_to_formula(smiles: str) -> str:
         'Invalid'
     """
     try:
-        # Handle NaN or None values
-        if pd.isna(smiles) or smiles is None:
-            return "Error"
-            
-        # Convert to string if not already
-        smiles_str = str(smiles).strip()
-        
+        if isinstance(smiles, str):
+            # Common case: already a string, no isna check needed
+            smiles_str = smiles.strip()
+        else:
+            # Handle NaN or None values
+            if smiles is None or pd.isna(smiles):
+                return "Error"
+            smiles_str = str(smiles).strip()
+
         # Check for empty string
         if not smiles_str:
             return "Error"
-            
-        # Parse SMILES using RDKit
-        mol = Chem.MolFromSmiles(smiles_str)
-        
-        if mol is not None:
-            # Calculate molecular formula
-            formula = rdMolDescriptors.CalcMolFormula(mol)
-            logger.debug(f"Converted SMILES '{smiles_str}' to formula '{formula}'")
-            return formula
-        else:
-            logger.warning(f"Could not parse SMILES: '{smiles_str}'")
+
+        # Trivial molecules: answer straight from the precomputed table
+        trivial = _TRIVIAL.get(smiles_str)
+        if trivial is not None:
+            return trivial
+
+        # Known placeholder values can never parse; skip RDKit entirely
+        if smiles_str.lower() in _KNOWN_BAD:
+            return "Invalid"
+
+        # Characters outside the SMILES alphabet: reject without RDKit
+        if _SMILES_CHARSET.fullmatch(smiles_str) is None:
+            logger.warning("Could not parse SMILES: '%s'", smiles_str)
             return "Invalid"
-            
+
+        return _smiles_to_formula_cached(smiles_str)
+
     except Exception as e:
-        logger.error(f"Error converting SMILES '{smiles}': {e}")
+        logger.error("Error converting SMILES '%s': %s", smiles, e)
         return "Error"
 
 
-def batch_smiles_to_formula(smiles_list: list) -> list:
+def _parse(smiles_str: str):
+    """Parse a stripped SMILES into a sanitized Mol, or None if invalid.
+
+    Single shared parse used by smiles_to_formula, validate_smiles and
+    smiles_info so no caller ever parses the same string twice.
+    """
+    mol = _mol_from_smiles(smiles_str, _PARSER_PARAMS)
+    if mol is None:
+        return None
+    try:
+        _sanitize_mol(mol, sanitizeOps=_FORMULA_SANITIZE_OPS)
+    except Exception:
+        # Sanitization failure == chemically invalid, same as a full parse
+        return None
+    return mol
+
+
+def _parse_formula(smiles_str: str) -> str:
+    """Pure RDKit kernel: stripped SMILES in, formula or 'Invalid' out."""
+    mol = _parse(smiles_str)
+    return _calc_formula(mol) if mol is not None else "Invalid"
+
+
+if _memory is not None:
+    # Keyed on the stripped string only, so whitespace variants share
+    # cache entries across runs
+    _parse_formula = _memory.cache(_parse_formula)
+
+
+@functools.lru_cache(maxsize=100_000)
+def _smiles_to_formula_cached(smiles_str: str) -> str:
+    """Parse a cleaned SMILES string with RDKit (memoized).
+
+    Keyed on the already-stripped string so duplicated SMILES — common in
+    metabolite tables — cost a dict lookup instead of a full parse. The
+    in-memory LRU sits on top of the optional on-disk cache.
+    """
+    formula = _parse_formula(smiles_str)
+
+    # Lazy %-style formatting plus an explicit level gate: the debug
+    # string is never built when debug logging is off
+    if formula != "Invalid":
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Converted SMILES '%s' to formula '%s'", smiles_str, formula)
+    else:
+        logger.warning("Could not parse SMILES: '%s'", smiles_str)
+    return formula
+
+
+# Below this many unique SMILES the serial path is used even when
+# parallel jobs are requested, so pool-spawn overhead can't dominate
+_PARALLEL_MIN_UNIQUE = 1000
+
+# Below this many rows a plain .apply beats pandarallel's worker startup
+_PANDARALLEL_MIN_ROWS = 500
+
+# Frames larger than this are processed in row chunks of this size so
+# the intermediate batch structures stay bounded
+_CHUNK_ROWS = 100_000
+
+# Lazily initialized on first use: None = not tried yet
+_pandarallel_ready = None
+
+
+def _init_pandarallel() -> bool:
+    """Initialize pandarallel once; returns False when it is not installed."""
+    global _pandarallel_ready
+    if _pandarallel_ready is None:
+        try:
+            import os
+            from pandarallel import pandarallel
+            pandarallel.initialize(nb_workers=os.cpu_count(),
+                                   progress_bar=False, verbose=0)
+            _pandarallel_ready = True
+        except ImportError:
+            _pandarallel_ready = False
+    return _pandarallel_ready
+
+
+def _formula_chunk(chunk: list) -> list:
+    """Convert one chunk of SMILES serially (worker-side helper)."""
+    return [smiles_to_formula(smiles) for smiles in chunk]
+
+
+def _batch_via_ext(smiles_list: list) -> list:
+    """Convert a batch through the compiled extension.
+
+    Applies the same NaN/empty/placeholder normalization as
+    smiles_to_formula, then hands the remaining clean strings to
+    smiles_formula_ext.formula_batch in one call.
+    """
+    results = [None] * len(smiles_list)
+    clean_indices = []
+    clean = []
+    for i, smiles in enumerate(smiles_list):
+        if not isinstance(smiles, str):
+            results[i] = "Error" if (smiles is None or pd.isna(smiles)) \
+                else smiles_to_formula(smiles)
+            continue
+        stripped = smiles.strip()
+        if not stripped:
+            results[i] = "Error"
+        elif stripped.lower() in _KNOWN_BAD:
+            results[i] = "Invalid"
+        else:
+            clean_indices.append(i)
+            clean.append(stripped)
+    if clean:
+        for i, formula in zip(clean_indices, _formula_batch_ext(clean)):
+            results[i] = formula
+    return results
+
+
+def batch_smiles_to_formula(smiles_list: list, n_jobs: int = 1) -> np.ndarray:
     """
     Convert a list of SMILES strings to molecular formulas.
-    
+
     Args:
         smiles_list (list): List of SMILES notation strings
-        
+        n_jobs (int): Number of joblib worker processes (1 = serial,
+                      -1 = all CPUs); requires joblib, and small batches
+                      always run serially
+
     Returns:
-        list: List of molecular formulas corresponding to input SMILES
-        
+        np.ndarray: Object array of molecular formulas corresponding to
+                    the input SMILES; integrates with pandas column
+                    assignment and NumPy indexing without another
+                    per-element conversion
+
     Examples:
-        >>> batch_smiles_to_formula(['CCO', 'O', 'C'])
+        >>> list(batch_smiles_to_formula(['CCO', 'O', 'C']))
         ['C2H6O', 'H2O', 'CH4']
     """
-    return [smiles_to_formula(smiles) for smiles in smiles_list]
+    if not smiles_list:
+        return np.empty(0, dtype=object)
+
+    # Normalize the whole batch in one vectorized pass: stringify, strip
+    # and mask out missing/empty entries up front so the RDKit loop below
+    # carries no per-element preamble
+    stripped = pd.Series(smiles_list, dtype=object).astype('string').str.strip()
+    valid_mask = (stripped.notna() & (stripped.str.len() > 0)).to_numpy()
+    out = np.full(len(smiles_list), "Error", dtype=object)
+    cleaned = stripped.to_numpy(dtype=object)[valid_mask]
+
+    # RDKit work scales with the number of distinct strings, not rows
+    unique = list(pd.unique(cleaned))
 
+    # Group similarly sized molecules: parse cost tracks SMILES length,
+    # so length order gives the parallel path near-equal chunk runtimes
+    # and the serial loop a more regular allocation pattern. The dict
+    # scatter below is order-independent, so no unpermute is needed.
+    unique.sort(key=len)
 
-def add_formula_column(df: pd.DataFrame, smiles_column: str, 
-                      formula_column: str = 'Formula') -> pd.DataFrame:
+    if (n_jobs != 1 and Parallel is not None
+            and len(unique) >= _PARALLEL_MIN_UNIQUE):
+        # One near-equal slice per worker: each process iterates its
+        # chunk serially, so spawn and pickling costs are amortized
+        workers = os.cpu_count() if n_jobs in (-1, 0, None) else n_jobs
+        chunk_size = -(-len(unique) // workers)
+        chunks = [unique[i:i + chunk_size]
+                  for i in range(0, len(unique), chunk_size)]
+        results = Parallel(n_jobs=workers, backend='loky')(
+            delayed(_formula_chunk)(chunk) for chunk in chunks)
+        formulas = dict(zip(unique, (f for chunk in results for f in chunk)))
+    elif _formula_batch_ext is not None:
+        # Compiled extension converts the whole unique set in one call
+        formulas = dict(zip(unique, _batch_via_ext(unique)))
+    else:
+        formulas = {s: smiles_to_formula(s) for s in unique}
+
+    out[valid_mask] = [formulas[s] for s in cleaned]
+    return out
+
+
+def add_formula_column(df: pd.DataFrame, smiles_column: str,
+                      formula_column: str = 'Formula',
+                      n_jobs: int = 1) -> pd.DataFrame:
     """
     Add a molecular formula column to a DataFrame based on SMILES column.
-    
+
     Args:
         df (pd.DataFrame): Input DataFrame containing SMILES data
         smiles_column (str): Name of the column containing SMILES strings
         formula_column (str): Name for the new formula column (default: 'Formula')
-        
+        n_jobs (int): Number of worker processes for SMILES parsing
+                      (1 = serial, -1 = all CPUs); small inputs always
+                      run serially
+
     Returns:
         pd.DataFrame: DataFrame with added formula column
-        
+
     Raises:
         ValueError: If the specified SMILES column doesn't exist in the DataFrame
-        
+
     Examples:
         >>> df = pd.DataFrame({'smiles': ['CCO', 'O']})
         >>> result = add_formula_column(df, 'smiles')
@@ -108,17 +350,76 @@ def add_formula_column(df: pd.DataFrame, smiles_column: str,
     """
     if smiles_column not in df.columns:
         raise ValueError(f"Column '{smiles_column}' not found in DataFrame")
-    
-    # Create a copy to avoid modifying the original DataFrame
-    result_df = df.copy()
-    
-    # Add formula column
-    result_df[formula_column] = result_df[smiles_column].apply(smiles_to_formula)
-    
+
+    # Huge frames go through the chunked path so intermediate batch
+    # structures stay bounded
+    if len(df) > _CHUNK_ROWS:
+        return add_formula_column_chunked(df, smiles_column, formula_column,
+                                          n_jobs=n_jobs)
+
+    # Shallow copy: existing column arrays are shared (only a new column
+    # is written, so the input frame is never mutated), avoiding a full
+    # O(rows x cols) buffer copy
+    result_df = df.copy(deep=False)
+
+    unique_smiles = result_df[smiles_column].dropna().unique()
+    if (n_jobs != 1 and len(unique_smiles) < _PARALLEL_MIN_UNIQUE
+            and len(result_df) >= _PANDARALLEL_MIN_ROWS and _init_pandarallel()):
+        # Too few unique values for the process pool but many rows:
+        # spread the rows themselves across pandarallel workers
+        result_df[formula_column] = result_df[smiles_column].parallel_apply(smiles_to_formula)
+    else:
+        # Compute each distinct SMILES once (batch_smiles_to_formula
+        # dispatches to joblib workers itself when worthwhile) and map
+        # the results back over the rows; NaN rows become 'Error'
+        formulas = batch_smiles_to_formula(list(unique_smiles), n_jobs=n_jobs)
+        formula_cache = dict(zip(unique_smiles, formulas))
+        result_df[formula_column] = result_df[smiles_column].map(formula_cache).fillna("Error")
+
     logger.info(f"Added formula column '{formula_column}' based on '{smiles_column}'")
     return result_df
 
 
+def add_formula_column_chunked(df: pd.DataFrame, smiles_column: str,
+                              formula_column: str = 'Formula',
+                              chunksize: int = _CHUNK_ROWS,
+                              n_jobs: int = 1) -> pd.DataFrame:
+    """
+    Add a molecular formula column by processing the SMILES column in chunks.
+
+    Converts chunksize rows at a time so the intermediate normalization
+    and lookup structures stay bounded regardless of frame size;
+    add_formula_column routes large frames here automatically.
+
+    Args:
+        df (pd.DataFrame): Input DataFrame containing SMILES data
+        smiles_column (str): Name of the column containing SMILES strings
+        formula_column (str): Name for the new formula column (default: 'Formula')
+        chunksize (int): Rows per processing chunk
+        n_jobs (int): Number of worker processes per chunk (see add_formula_column)
+
+    Returns:
+        pd.DataFrame: DataFrame with added formula column
+
+    Raises:
+        ValueError: If the specified SMILES column doesn't exist in the DataFrame
+    """
+    if smiles_column not in df.columns:
+        raise ValueError(f"Column '{smiles_column}' not found in DataFrame")
+
+    result_df = df.copy(deep=False)
+    values = result_df[smiles_column].to_numpy(dtype=object)
+    n_chunks = max(1, -(-len(values) // chunksize))
+
+    parts = [batch_smiles_to_formula(list(chunk), n_jobs=n_jobs)
+             for chunk in np.array_split(values, n_chunks)]
+    result_df[formula_column] = np.concatenate(parts)
+
+    logger.info(f"Added formula column '{formula_column}' based on "
+                f"'{smiles_column}' ({n_chunks} chunks)")
+    return result_df
+
+
 def find_smiles_column(df: pd.DataFrame) -> Optional[str]:
     """
     Find a SMILES column in a DataFrame (case-insensitive search).
@@ -137,11 +438,15 @@ def find_smiles_column(df: pd.DataFrame) -> Optional[str]:
         >>> find_smiles_column(df)
         'smiles'
     """
-    for col in df.columns:
-        if col.lower() == 'smiles':
-            logger.debug(f"Found SMILES column: '{col}'")
-            return col
-    
+    # Single vectorized pass over the column Index; also recognizes the
+    # common alternate spellings
+    lowered = df.columns.str.lower()
+    mask = lowered.isin(('smiles', 'canonical_smiles', 'smi'))
+    if mask.any():
+        col = df.columns[mask][0]
+        logger.debug("Found SMILES column: '%s'", col)
+        return col
+
     logger.warning("No SMILES column found in DataFrame")
     return None
 
@@ -165,14 +470,42 @@ def validate_smiles(smiles: str) -> bool:
     try:
         if pd.isna(smiles) or not str(smiles).strip():
             return False
-        
-        mol = Chem.MolFromSmiles(str(smiles).strip())
-        return mol is not None
+
+        smiles_str = str(smiles).strip()
+        if _SMILES_CHARSET.fullmatch(smiles_str) is None:
+            return False
+
+        return _parse(smiles_str) is not None
         
     except Exception:
         return False
 
 
+def smiles_info(smiles: str) -> Tuple[bool, str]:
+    """
+    Validate a SMILES string and compute its formula with a single parse.
+
+    smiles_to_formula and validate_smiles are convenience wrappers that
+    each answer one of the two questions; pipelines needing both should
+    call this instead of paying for two parses per string.
+
+    Args:
+        smiles (str): SMILES notation string
+
+    Returns:
+        Tuple[bool, str]: (is_valid, formula); formula carries the usual
+                          'Invalid'/'Error' sentinels when is_valid is False
+
+    Examples:
+        >>> smiles_info('CCO')
+        (True, 'C2H6O')
+        >>> smiles_info('invalid_smiles')
+        (False, 'Invalid')
+    """
+    formula = smiles_to_formula(smiles)
+    return formula not in ("Invalid", "Error"), formula
+
+
 def get_formula_statistics(df: pd.DataFrame, formula_column: str = 'Formula') -> dict:
     """
     Get statistics about formula generation success rate.
@@ -194,8 +527,10 @@ def get_formula_statistics(df: pd.DataFrame, formula_column: str = 'Formula') ->
         raise ValueError(f"Column '{formula_column}' not found in DataFrame")
     
     total = len(df)
-    invalid_count = (df[formula_column] == 'Invalid').sum()
-    error_count = (df[formula_column] == 'Error').sum()
+    # One value_counts pass instead of an equality scan per sentinel
+    counts = df[formula_column].value_counts()
+    invalid_count = int(counts.get('Invalid', 0))
+    error_count = int(counts.get('Error', 0))
     valid_count = total - invalid_count - error_count
     
     stats = {